@@ -3,14 +3,182 @@ Planner node for LangGraph agent.
 Uses LLM to break natural language instructions into actionable steps.
 """
 
-import json
-from typing import Dict, List, Any
+import asyncio
+import copy
+import functools
+import hashlib
+import operator
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, List, Literal, Tuple, Any
+import orjson
+import simdjson
+from openai import OpenAI
+from pydantic import BaseModel, ConfigDict
 from langchain_openai import ChatOpenAI
 from langchain_community.llms import Ollama
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from .config import get_config
 
+# Number of distinct user inputs whose plans are kept in memory
+PLAN_CACHE_SIZE = 256
+
+# How long Ollama keeps the model (and its prompt KV cache) loaded between calls
+OLLAMA_KEEP_ALIVE = "30m"
+
+# Fields every plan step must provide
+REQUIRED_STEP_FIELDS = frozenset(('step', 'description', 'task', 'category'))
+
+# Serializer for plans and graph state handed to downstream nodes (returns bytes)
+serialize_plan = orjson.dumps
+
+# Shared, read-only part of the single-step plan used when no real plan is available
+_FALLBACK_STEP = MappingProxyType({
+    "step": 1,
+    "description": "Execute user request",
+    "category": "other"
+})
+
+
+def _basic_plan(task: str, warning: str, summary: str = "Execute user request") -> Dict[str, Any]:
+    """
+    Build a single-step plan that runs the request as-is.
+    
+    Used for unparseable LLM responses (task is the response text) and for
+    planning failures (task is the user input).
+    """
+    return {
+        "plan": [{**_FALLBACK_STEP, "task": task}],
+        "summary": summary,
+        "estimated_time": "Unknown",
+        "requires_sudo": False,
+        "warnings": [warning]
+    }
+
+
+class PlanStep(BaseModel):
+    """A single step of a plan."""
+    
+    model_config = ConfigDict(extra='forbid')
+    
+    step: int
+    description: str
+    task: str
+    category: Literal['install', 'configure', 'start', 'stop', 'check', 'create', 'delete', 'update', 'other']
+
+
+class Plan(BaseModel):
+    """Plan returned by the planner LLM."""
+    
+    model_config = ConfigDict(extra='forbid')
+    
+    plan: List[PlanStep]
+    summary: str
+    estimated_time: str
+    requires_sudo: bool
+    warnings: List[str]
+
+
+# OpenAI structured output format; the model can only emit JSON matching Plan
+PLAN_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "plan",
+        "strict": True,
+        "schema": Plan.model_json_schema()
+    }
+}
+
+
+def _check_step_fields(keys: Iterable[str]) -> None:
+    """Raise ValueError naming every required step field missing from keys."""
+    missing = REQUIRED_STEP_FIELDS.difference(keys)
+    if missing:
+        raise ValueError(f"Step is missing required fields: {', '.join(sorted(missing))}")
+
+
+def _scalar(value: Any, field: str) -> Any:
+    """Return a decoded plan field, rejecting nested arrays and objects."""
+    # simdjson proxies are tied to the parser, so they must not leave the parse
+    if isinstance(value, (simdjson.Array, simdjson.Object)):
+        raise ValueError(f"Plan field '{field}' must not be an array or object")
+    return value
+
+
+class UnparsedPlanError(ValueError):
+    """Raised when an LLM response has no parseable plan JSON."""
+    
+    def __init__(self, plan: Dict[str, Any]):
+        super().__init__(plan['warnings'][0])
+        self.plan = plan
+
+
+class _StepStream:
+    """Incrementally picks completed plan steps out of streamed JSON text."""
+    
+    def __init__(self):
+        self.buf = ''
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._plan_depth = None
+        self._step_start = None
+    
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Append streamed text and return any steps completed by it.
+        
+        Args:
+            text: Next chunk of the LLM response
+            
+        Returns:
+            Step dictionaries whose closing brace arrived in this chunk
+        """
+        self.buf += text
+        buf = self.buf
+        steps = []
+        
+        while self._pos < len(buf) and not self.done:
+            ch = buf[self._pos]
+            
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = buf[self._string_start:self._pos]
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = self._pos + 1
+            elif ch in '{[':
+                self._depth += 1
+                # The "plan" key's array opens directly inside the top-level object
+                if ch == '[' and self._plan_depth is None and self._depth == 2 and self._last_string == 'plan':
+                    self._plan_depth = self._depth
+                elif ch == '{' and self._plan_depth is not None and self._depth == self._plan_depth + 1:
+                    self._step_start = self._pos
+            elif ch in '}]':
+                if self._plan_depth is not None:
+                    if ch == '}' and self._depth == self._plan_depth + 1 and self._step_start is not None:
+                        steps.append(orjson.loads(buf[self._step_start:self._pos + 1]))
+                        self._step_start = None
+                    elif ch == ']' and self._depth == self._plan_depth:
+                        self.done = True
+                self._depth -= 1
+            
+            self._pos += 1
+        
+        return steps
+
+
 class PlannerNode:
     """LangGraph node that plans tasks from natural language input."""
     
@@ -18,7 +186,10 @@ class PlannerNode:
         """Initialize the planner node."""
         self.config = get_config()
         self.llm_config = self.config.get_llm_config()
-        self.llm = self._create_llm()
+        
+        # simdjson parsers keep their padded buffer between calls but handle
+        # one document at a time, so each thread gets its own (see _parser)
+        self._local = threading.local()
         
         # System prompt for planning
         self.system_prompt = """You are an expert system administrator and DevOps engineer. Your job is to break down natural language instructions into clear, actionable steps that can be executed as shell commands.
@@ -29,6 +200,13 @@ For each user request, analyze what needs to be done and create a step-by-step p
 3. Safe and follow best practices
 4. Ordered logically (dependencies first)
 
+Be thorough but concise. Focus on practical, executable steps."""
+        
+        # OpenAI enforces the plan schema through structured output; other
+        # backends need the format and examples spelled out in the prompt
+        if self.llm_config['type'] != 'openai':
+            self.system_prompt += """
+
 Return your response as a JSON object with the following structure:
 {
     "plan": [
@@ -97,28 +275,65 @@ Response:
     "estimated_time": "< 1 minute",
     "requires_sudo": false,
     "warnings": []
-}
-
-Be thorough but concise. Focus on practical, executable steps."""
+}"""
+        
+        # Created after the system prompt so the prompt cache key can follow it
+        self.llm = self._create_llm()
+        
+        # The system prompt is constant, so build its message once
+        self._system_message = SystemMessage(content=self.system_prompt)
+        
+        # Compile the prompt once; the system message is passed as-is so the
+        # JSON braces in it are not treated as template variables
+        self._chain = ChatPromptTemplate.from_messages([
+            self._system_message,
+            ("human", "{input}")
+        ]) | self.llm
+        
+        # Identical requests are common in interactive use; cache per instance
+        # so the key is effectively (user_input, model). Only plan() goes
+        # through the cache; aplan, plan_many and stream_plan always call the LLM.
+        self._plan_cached = functools.lru_cache(maxsize=PLAN_CACHE_SIZE)(self._plan_impl)
     
     def _create_llm(self):
         """Create LLM instance based on configuration."""
         if self.llm_config['type'] == 'openai':
+            # Chat models return messages; the text lives in .content
+            self._extract_content = operator.attrgetter('content')
             return ChatOpenAI(
                 api_key=self.llm_config['api_key'],
                 model=self.llm_config['model'],
                 temperature=0.1,
-                timeout=self.llm_config['timeout']
-            )
+                timeout=self.llm_config['timeout'],
+                # Route requests sharing the system prompt to the same cached prefix;
+                # sent as extra_body so SDKs without a prompt_cache_key argument accept it
+                extra_body={"prompt_cache_key": self._prompt_cache_key()}
+            ).bind(response_format=PLAN_RESPONSE_FORMAT)
         elif self.llm_config['type'] == 'ollama':
+            # Completion models return plain strings
+            self._extract_content = str
             return Ollama(
                 model=self.llm_config['model'],
                 base_url=self.llm_config['base_url'],
-                temperature=0.1
+                temperature=0.1,
+                # Keep the model loaded so its cached system prompt prefix is reused
+                keep_alive=OLLAMA_KEEP_ALIVE
             )
         else:
             raise ValueError(f"Unsupported LLM type: {self.llm_config['type']}")
     
+    def _prompt_cache_key(self) -> str:
+        """Cache key for the system prompt; changes whenever the prompt does."""
+        digest = hashlib.sha256(self.system_prompt.encode()).hexdigest()[:16]
+        return f"aish-planner-{digest}"
+    
+    def _parser(self) -> simdjson.Parser:
+        """Return this thread's simdjson parser, creating it on first use."""
+        parser = getattr(self._local, 'parser', None)
+        if parser is None:
+            parser = self._local.parser = simdjson.Parser()
+        return parser
+    
     def _parse_response(self, response: str) -> Dict[str, Any]:
         """
         Parse LLM response and extract plan.
@@ -128,56 +343,124 @@ Be thorough but concise. Focus on practical, executable steps."""
             
         Returns:
             Parsed plan dictionary
+            
+        Raises:
+            UnparsedPlanError: If the response holds no parseable JSON; the
+                error carries a basic plan built from the response text
+            ValueError: If the JSON does not describe a valid plan
         """
         try:
-            # Try to parse as JSON
-            if response.strip().startswith('{'):
-                return json.loads(response)
+            # Scan for the JSON braces on the encoded bytes (1 byte per char,
+            # memchr-backed) and hand the same buffer to the parser
+            buf = response.encode()
+            start_idx = buf.find(b'{')
             
-            # If not JSON, try to extract JSON from response
-            start_idx = response.find('{')
-            end_idx = response.rfind('}') + 1
+            if start_idx == -1:
+                # If no JSON found, the response text itself becomes the task
+                raise UnparsedPlanError(
+                    _basic_plan(response.strip(), "Could not parse detailed plan")
+                )
             
-            if start_idx != -1 and end_idx != -1:
-                json_str = response[start_idx:end_idx]
-                return json.loads(json_str)
-            
-            # If no JSON found, create a basic plan
-            return {
-                "plan": [
-                    {
-                        "step": 1,
-                        "description": "Execute user request",
-                        "task": response.strip(),
-                        "category": "other"
-                    }
-                ],
-                "summary": "Execute user request",
-                "estimated_time": "Unknown",
-                "requires_sudo": False,
-                "warnings": ["Could not parse detailed plan"]
-            }
+            # Try to parse as JSON
+            if not buf[:start_idx].strip():
+                doc = self._parser().parse(buf)
+            else:
+                # If not JSON, try to extract JSON from response
+                end_idx = buf.rfind(b'}') + 1
+                doc = self._parser().parse(buf[start_idx:end_idx])
             
-        except json.JSONDecodeError as e:
+        except UnparsedPlanError:
+            raise
+        except ValueError as e:
             if self.config.debug:
                 print(f"Debug: JSON parse error: {e}")
                 print(f"Debug: Response: {response}")
             
             # Fallback to basic plan
-            return {
-                "plan": [
-                    {
-                        "step": 1,
-                        "description": "Execute user request",
-                        "task": response.strip(),
-                        "category": "other"
-                    }
-                ],
-                "summary": "Execute user request",
-                "estimated_time": "Unknown",
-                "requires_sudo": False,
-                "warnings": ["Could not parse LLM response"]
-            }
+            raise UnparsedPlanError(
+                _basic_plan(response.strip(), "Could not parse LLM response")
+            ) from e
+        
+        return self._extract_plan(doc)
+    
+    def _extract_plan(self, doc) -> Dict[str, Any]:
+        """
+        Build a plan dictionary from a parsed simdjson document.
+        
+        Only the fields consumed downstream are decoded, and each step is
+        validated as it is read rather than in a separate pass.
+        
+        Args:
+            doc: simdjson Object for the LLM response
+            
+        Returns:
+            Plan dictionary with steps and metadata, holding only plain
+            Python values so no simdjson proxy outlives the parse
+            
+        Raises:
+            ValueError: If a field is missing or holds a nested array or object
+        """
+        steps = doc.get('plan')
+        if not isinstance(steps, simdjson.Array):
+            raise ValueError("Plan must contain a list of steps")
+        
+        # Each step is validated as it is read, so the first bad step fails
+        # the plan without a second walk over the steps
+        plan_steps = []
+        for step in steps:
+            if not isinstance(step, simdjson.Object):
+                raise ValueError("Each step must be an object with step, description, task, and category fields")
+            _check_step_fields(step.keys())
+            plan_steps.append({
+                "step": _scalar(step['step'], 'step'),
+                "description": _scalar(step['description'], 'description'),
+                "task": _scalar(step['task'], 'task'),
+                "category": _scalar(step['category'], 'category')
+            })
+        
+        warnings = doc.get('warnings')
+        
+        return {
+            "plan": plan_steps,
+            "summary": _scalar(doc.get('summary', ''), 'summary'),
+            "estimated_time": _scalar(doc.get('estimated_time', 'Unknown'), 'estimated_time'),
+            "requires_sudo": _scalar(doc.get('requires_sudo', False), 'requires_sudo'),
+            "warnings": warnings.as_list() if isinstance(warnings, simdjson.Array) else []
+        }
+    
+    def _finish(self, response: Any) -> Dict[str, Any]:
+        """
+        Turn a raw LLM response into a validated plan.
+        
+        Args:
+            response: Message (OpenAI) or string (Ollama) returned by the LLM
+            
+        Returns:
+            Parsed plan dictionary
+        """
+        # Extract content based on LLM type
+        content = self._extract_content(response)
+        
+        if self.config.debug:
+            print(f"Debug: LLM response: {content}")
+        
+        # Parse and validate response
+        return self._parse_response(content)
+    
+    def _fallback_plan(self, user_input: str, error: Exception) -> Dict[str, Any]:
+        """Build the single-step plan used when planning fails."""
+        if self.config.debug:
+            print(f"Debug: Planning error: {error}")
+        
+        # Unparseable responses come with their own plan built from the text
+        if isinstance(error, UnparsedPlanError):
+            return error.plan
+        
+        return _basic_plan(
+            user_input,
+            f"Planning failed: {str(error)}",
+            summary="Execute user request (fallback plan)"
+        )
     
     def plan(self, user_input: str) -> Dict[str, Any]:
         """
@@ -190,60 +473,250 @@ Be thorough but concise. Focus on practical, executable steps."""
             Plan dictionary with steps and metadata
         """
         try:
-            # Create prompt
-            messages = [
-                SystemMessage(content=self.system_prompt),
-                HumanMessage(content=user_input)
-            ]
+            # Copy so callers can't mutate the cached plan
+            return copy.deepcopy(self._plan_cached(user_input))
             
-            # Get LLM response
-            if self.config.debug:
-                print(f"Debug: Sending to LLM: {user_input}")
+        except Exception as e:
+            return self._fallback_plan(user_input, e)
+    
+    def _plan_impl(self, user_input: str) -> Dict[str, Any]:
+        """
+        Ask the LLM for a plan, raising on failure.
+        
+        Wrapped per instance by an LRU cache in __init__, so repeated inputs
+        skip the LLM. Unusable responses raise (see _parse_response) and
+        plan() turns the error into the fallback plan, so fallback plans
+        never enter the cache.
+        
+        Args:
+            user_input: Natural language instruction
             
-            response = self.llm.invoke(messages)
+        Returns:
+            Plan dictionary with steps and metadata
+        """
+        # Get LLM response
+        if self.config.debug:
+            print(f"Debug: Sending to LLM: {user_input}")
+        
+        response = self._chain.invoke({"input": user_input})
+        return self._finish(response)
+    
+    def stream_plan(self, user_input: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Stream plan steps as the LLM generates them.
+        
+        Each step is yielded as soon as its JSON object is complete, so the
+        first steps can be dispatched while later ones are still being
+        generated. Once the response ends, the complete plan is yielded with
+        its metadata (summary, requires_sudo, warnings). If no step could be
+        picked out of the stream, the steps of the fully parsed (or fallback)
+        plan are yielded first. Results are not cached.
+        
+        Args:
+            user_input: Natural language instruction
             
-            # Extract content based on LLM type
-            if hasattr(response, 'content'):
-                content = response.content
-            else:
-                content = str(response)
+        Yields:
+            ('step', step) for each step in plan order, then ('plan', plan)
             
+        Raises:
+            RuntimeError: If the stream fails after steps were yielded; the
+                steps already handed out are not a complete plan
+        """
+        scanner = _StepStream()
+        yielded = 0
+        
+        try:
             if self.config.debug:
-                print(f"Debug: LLM response: {content}")
+                print(f"Debug: Streaming from LLM: {user_input}")
             
-            # Parse response
-            plan = self._parse_response(content)
+            for chunk in self._chain.stream({"input": user_input}):
+                text = self._extract_content(chunk)
+                for step in scanner.feed(text):
+                    # Validate each step as it is parsed instead of after the stream
+                    if not isinstance(step, dict):
+                        raise ValueError("Each step must be an object with step, description, task, and category fields")
+                    _check_step_fields(step.keys())
+                    yielded += 1
+                    yield ('step', step)
             
-            # Validate plan structure
-            if not isinstance(plan.get('plan'), list):
-                raise ValueError("Plan must contain a list of steps")
+            plan = self._parse_response(scanner.buf)
+            if yielded and len(plan['plan']) != yielded:
+                raise ValueError(f"Streamed {yielded} steps but the full plan has {len(plan['plan'])}")
             
-            # Ensure all steps have required fields
+        except Exception as e:
+            if yielded:
+                # Steps already handed out can't be replaced by a fallback, so
+                # the caller must learn that the plan was cut off
+                raise RuntimeError(f"Plan stream failed after {yielded} steps: {e}") from e
+            plan = self._fallback_plan(user_input, e)
+        
+        if not yielded:
             for step in plan['plan']:
-                if not all(key in step for key in ['step', 'description', 'task', 'category']):
-                    raise ValueError("Each step must have step, description, task, and category fields")
+                yield ('step', step)
+        
+        yield ('plan', plan)
+    
+    async def aplan(self, user_input: str) -> Dict[str, Any]:
+        """
+        Asynchronously create a plan from natural language input.
+        
+        Unlike plan(), results are not cached.
+        
+        Args:
+            user_input: Natural language instruction
+            
+        Returns:
+            Plan dictionary with steps and metadata
+        """
+        try:
+            if self.config.debug:
+                print(f"Debug: Sending to LLM: {user_input}")
             
-            return plan
+            response = await self._chain.ainvoke({"input": user_input})
+            return self._finish(response)
             
         except Exception as e:
+            return self._fallback_plan(user_input, e)
+    
+    async def plan_many(self, inputs: List[str], max_concurrency: int = 16) -> List[Dict[str, Any]]:
+        """
+        Create plans for several inputs concurrently.
+        
+        Unlike plan(), results are not cached.
+        
+        Args:
+            inputs: Natural language instructions
+            max_concurrency: Maximum number of in-flight LLM requests
+            
+        Returns:
+            Plans in the same order as the inputs
+        """
+        if self.config.debug:
+            print(f"Debug: Sending {len(inputs)} requests to LLM")
+        
+        responses = await self._chain.abatch(
+            [{"input": user_input} for user_input in inputs],
+            config={"max_concurrency": max_concurrency},
+            return_exceptions=True
+        )
+        
+        plans = []
+        for user_input, response in zip(inputs, responses):
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                plans.append(self._finish(response))
+            except Exception as e:
+                plans.append(self._fallback_plan(user_input, e))
+        
+        return plans
+    
+    def plan_batch_offline(self, inputs: List[str], poll_interval: int = 30) -> List[Dict[str, Any]]:
+        """
+        Create plans for many inputs through the OpenAI Batch API.
+        
+        Intended for non-interactive bulk planning where throughput and cost
+        matter more than latency. Blocks until the batch finishes. Ollama
+        backends fall back to plan_many.
+        
+        This method is synchronous only; from async code (e.g. an async
+        LangGraph run) await plan_many instead.
+        
+        Args:
+            inputs: Natural language instructions
+            poll_interval: Seconds to wait between batch status checks
+            
+        Returns:
+            Plans in the same order as the inputs
+            
+        Raises:
+            RuntimeError: If called while an event loop is running
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("plan_batch_offline blocks and cannot run inside an event loop; await plan_many instead")
+        
+        if self.llm_config['type'] != 'openai':
+            return asyncio.run(self.plan_many(inputs))
+        
+        client = OpenAI(
+            api_key=self.llm_config['api_key'],
+            timeout=self.llm_config['timeout']
+        )
+        
+        # One chat completion request per input, keyed by its index
+        lines = []
+        for i, user_input in enumerate(inputs):
+            lines.append(orjson.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": self.llm_config['model'],
+                    "messages": [
+                        {"role": "system", "content": self.system_prompt},
+                        {"role": "user", "content": user_input}
+                    ],
+                    "temperature": 0.1,
+                    "response_format": PLAN_RESPONSE_FORMAT
+                }
+            }))
+        
+        batch_file = client.files.create(
+            file=("aish_plans.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        
+        contents = {}
+        try:
+            batch = client.batches.create(
+                endpoint="/v1/chat/completions",
+                input_file_id=batch_file.id,
+                completion_window="24h"
+            )
+            
             if self.config.debug:
-                print(f"Debug: Planning error: {e}")
+                print(f"Debug: Submitted batch {batch.id} with {len(inputs)} requests")
             
-            # Return fallback plan
-            return {
-                "plan": [
-                    {
-                        "step": 1,
-                        "description": "Execute user request",
-                        "task": user_input,
-                        "category": "other"
-                    }
-                ],
-                "summary": "Execute user request (fallback plan)",
-                "estimated_time": "Unknown",
-                "requires_sudo": False,
-                "warnings": [f"Planning failed: {str(e)}"]
-            }
+            while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+                time.sleep(poll_interval)
+                batch = client.batches.retrieve(batch.id)
+            
+            # Collect the responses that came back, by input index
+            if batch.output_file_id:
+                try:
+                    output = client.files.content(batch.output_file_id).text
+                finally:
+                    client.files.delete(batch.output_file_id)
+                
+                for line in output.splitlines():
+                    if not line.strip():
+                        continue
+                    result = orjson.loads(line)
+                    body = (result.get('response') or {}).get('body') or {}
+                    choices = body.get('choices') or []
+                    if choices:
+                        contents[int(result['custom_id'])] = choices[0]['message']['content']
+            
+            if batch.error_file_id:
+                client.files.delete(batch.error_file_id)
+        finally:
+            # Don't leave request payloads behind in the account's file storage
+            client.files.delete(batch_file.id)
+        
+        plans = []
+        for i, user_input in enumerate(inputs):
+            try:
+                if i not in contents:
+                    raise RuntimeError(f"Batch {batch.id} returned no response (status: {batch.status})")
+                plans.append(self._parse_response(contents[i]))
+            except Exception as e:
+                plans.append(self._fallback_plan(user_input, e))
+        
+        return plans
     
     def __call__(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """
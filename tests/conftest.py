@@ -0,0 +1,22 @@
+"""
+Shared test setup.
+
+aish_agent.config is not part of this tree, so a minimal stand-in is
+installed before planner_node imports it. Tests build nodes without
+calling get_config().
+"""
+
+import sys
+import types
+
+if 'aish_agent.config' not in sys.modules:
+    try:
+        import aish_agent.config  # noqa: F401
+    except ImportError:
+        config = types.ModuleType('aish_agent.config')
+        
+        def get_config():
+            raise RuntimeError("aish_agent.config is not available in tests")
+        
+        config.get_config = get_config
+        sys.modules['aish_agent.config'] = config
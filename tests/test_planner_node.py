@@ -0,0 +1,218 @@
+"""
+Tests for PlannerNode response parsing.
+"""
+
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from aish_agent.planner_node import PLAN_CACHE_SIZE, PlannerNode, UnparsedPlanError
+
+
+@pytest.fixture
+def node():
+    """Planner node with parsing state only; no LLM is created."""
+    node = PlannerNode.__new__(PlannerNode)
+    node.config = SimpleNamespace(debug=False)
+    node._local = threading.local()
+    return node
+
+
+VALID_RESPONSE = """{
+    "plan": [
+        {"step": 1, "description": "List processes", "task": "Show running processes", "category": "check"}
+    ],
+    "summary": "Display all running processes",
+    "estimated_time": "< 1 minute",
+    "requires_sudo": false,
+    "warnings": ["Output may be long"]
+}"""
+
+
+def test_parse_valid_response(node):
+    plan = node._parse_response(VALID_RESPONSE)
+    
+    assert plan == {
+        "plan": [
+            {"step": 1, "description": "List processes", "task": "Show running processes", "category": "check"}
+        ],
+        "summary": "Display all running processes",
+        "estimated_time": "< 1 minute",
+        "requires_sudo": False,
+        "warnings": ["Output may be long"]
+    }
+
+
+def test_parse_response_with_surrounding_text(node):
+    plan = node._parse_response(f"Here is the plan:\n{VALID_RESPONSE}\nDone.")
+    
+    assert plan["plan"][0]["task"] == "Show running processes"
+
+
+@pytest.mark.parametrize("response", [
+    '{"plan": [{"step": 1, "description": "d", "task": ["apt update", "apt install nginx"], "category": "install"}]}',
+    '{"plan": [{"step": 1, "description": {"text": "d"}, "task": "t", "category": "install"}]}',
+    '{"plan": [], "summary": {"text": "s"}}',
+    '{"plan": [], "estimated_time": ["2 minutes"]}',
+    '{"plan": [], "requires_sudo": {"value": true}}',
+])
+def test_nested_fields_are_rejected(node, response):
+    with pytest.raises(ValueError):
+        node._parse_response(response)
+    
+    # No simdjson proxy may outlive the failed parse
+    assert node._parse_response(VALID_RESPONSE)["summary"] == "Display all running processes"
+
+
+def test_loosely_typed_scalars_are_kept(node):
+    plan = node._parse_response(
+        '{"plan": [{"step": "1", "description": "d", "task": "t", "category": "other"}],'
+        ' "requires_sudo": "true", "warnings": [{"text": "w"}]}'
+    )
+    
+    assert plan["plan"][0]["step"] == "1"
+    assert plan["requires_sudo"] == "true"
+    assert plan["warnings"] == [{"text": "w"}]
+
+
+def test_missing_step_fields_are_rejected(node):
+    with pytest.raises(ValueError, match="missing required fields: description, task"):
+        node._parse_response('{"plan": [{"step": 1, "category": "other"}]}')
+
+
+def test_non_object_step_is_rejected(node):
+    with pytest.raises(ValueError, match="must be an object"):
+        node._parse_response('{"plan": ["apt update"]}')
+
+
+def test_missing_plan_is_rejected(node):
+    with pytest.raises(ValueError, match="list of steps"):
+        node._parse_response('{"summary": "no steps"}')
+
+
+def test_top_level_array_is_rejected(node):
+    with pytest.raises(ValueError):
+        node._parse_response('[{"step": 1, "description": "d", "task": "t", "category": "other"}]')
+    
+    assert node._parse_response(VALID_RESPONSE)["plan"][0]["step"] == 1
+
+
+class FakeChain:
+    """Chain stand-in returning canned LLM responses in order."""
+    
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+    
+    def invoke(self, inputs):
+        self.calls += 1
+        return self.responses.pop(0)
+    
+    def stream(self, inputs):
+        # Each response is a list of chunks; an exception chunk is raised
+        self.calls += 1
+        for chunk in self.responses.pop(0):
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+@pytest.fixture
+def cached_node(node):
+    """Planner node wired for plan() with a fake chain."""
+    node._extract_content = str
+    node._plan_cached = functools.lru_cache(maxsize=PLAN_CACHE_SIZE)(node._plan_impl)
+    return node
+
+
+def test_non_json_response_carries_text_plan(node):
+    with pytest.raises(UnparsedPlanError) as excinfo:
+        node._parse_response("Just run ps aux")
+    
+    assert excinfo.value.plan["plan"][0]["task"] == "Just run ps aux"
+
+
+def test_plan_caches_repeated_inputs(cached_node):
+    cached_node._chain = FakeChain(VALID_RESPONSE)
+    
+    first = cached_node.plan("show me all running processes")
+    first["plan"].clear()
+    second = cached_node.plan("show me all running processes")
+    
+    assert cached_node._chain.calls == 1
+    assert second["plan"][0]["task"] == "Show running processes"
+
+
+@pytest.mark.parametrize("bad_response, warning", [
+    ("Just run ps aux", "Could not parse detailed plan"),
+    ('{"plan": [oops', "Could not parse LLM response"),
+])
+def test_plan_does_not_cache_fallback(cached_node, bad_response, warning):
+    cached_node._chain = FakeChain(bad_response, VALID_RESPONSE)
+    
+    fallback = cached_node.plan("show me all running processes")
+    plan = cached_node.plan("show me all running processes")
+    
+    # The unparsed response text becomes the task, as before caching
+    assert fallback["summary"] == "Execute user request"
+    assert fallback["plan"][0]["task"] == bad_response
+    assert fallback["warnings"] == [warning]
+    assert plan["summary"] == "Display all running processes"
+    assert cached_node._chain.calls == 2
+
+
+def chunked(text, size=7):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def test_stream_plan_yields_steps_then_plan(cached_node):
+    cached_node._chain = FakeChain(chunked(VALID_RESPONSE))
+    
+    events = list(cached_node.stream_plan("show me all running processes"))
+    
+    assert [kind for kind, _ in events] == ['step', 'plan']
+    assert events[0][1]["task"] == "Show running processes"
+    assert events[1][1]["warnings"] == ["Output may be long"]
+
+
+def test_stream_plan_raises_when_cut_off(cached_node):
+    cut = VALID_RESPONSE.index('"summary"')
+    cached_node._chain = FakeChain(chunked(VALID_RESPONSE[:cut]) + [ConnectionError("reset")])
+    
+    stream = cached_node.stream_plan("show me all running processes")
+    
+    assert next(stream)[0] == 'step'
+    with pytest.raises(RuntimeError, match="after 1 steps"):
+        next(stream)
+
+
+def test_stream_plan_falls_back_without_steps(cached_node):
+    cached_node._chain = FakeChain(["Just run ", "ps aux"])
+    
+    events = list(cached_node.stream_plan("show me all running processes"))
+    
+    assert [kind for kind, _ in events] == ['step', 'plan']
+    assert events[0][1]["task"] == "Just run ps aux"
+    assert events[1][1]["warnings"] == ["Could not parse detailed plan"]
+
+
+def test_stream_reports_missing_fields_like_parse(cached_node):
+    cached_node._chain = FakeChain(chunked('{"plan": [{"step": 1, "category": "other"}]}'))
+    
+    events = list(cached_node.stream_plan("show me all running processes"))
+    
+    assert events[-1][1]["warnings"] == [
+        "Planning failed: Step is missing required fields: description, task"
+    ]
+
+
+def test_plan_from_many_threads(cached_node):
+    cached_node._chain = SimpleNamespace(invoke=lambda inputs: VALID_RESPONSE)
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        plans = list(pool.map(cached_node.plan, [f"request {i}" for i in range(800)]))
+    
+    assert all(plan["summary"] == "Display all running processes" for plan in plans)